@@ -2,86 +2,317 @@
 """
 Flask backend that supports:
 - POST /create_order  -> create order (real razorpay if configured, otherwise DUMMY)
-- POST /verify_payment -> verify payment, then generate PDF certificate and send email
+- POST /verify_payment -> verify payment, generate the PDF certificate, then queue the email
 - GET  /certificate/<filename> -> serve certificate PDF
+- POST /send_bulk_certificates -> (admin) email certificates to every donor in BULK_LIST_PATH
+
+Run in production with gunicorn (see gunicorn.conf.py): gunicorn backend_prod_ready:app
+(or without the config file: gunicorn backend_prod_ready:app -k gevent -w 4).
+`python backend_prod_ready.py` is for local development; FLASK_DEBUG=1 enables the reloader/debugger.
 
 Environment variables:
 - USE_RAZORPAY = '1' to enable real razorpay use (requires RAZORPAY_KEY_ID & RAZORPAY_KEY_SECRET)
 - RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET, RAZORPAY_WEBHOOK_SECRET (optional)
 - SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS, FROM_EMAIL  (to send emails)
-- FRONTEND_ORIGIN (optional)
+- FRONTEND_ORIGIN (optional) -> allowed CORS origin; all origins when unset
+- CERT_DIR (optional) -> where certificates are written; default ./certificates
+- CERT_DIR_VOLATILE = '1' when CERT_DIR is RAM-backed (tmpfs): it is copied to ./certificates
+  on shutdown, which needs gunicorn.conf.py or the __main__ block; must be a private directory
+- ADMIN_TOKEN (optional) -> bearer token for admin endpoints; they are disabled when unset
+- BULK_LIST_PATH (optional) -> JSON list of {name, email, amount, order_id}; default ./bulk_certificates.json
+- USE_X_SENDFILE = '1' when running behind a proxy that honours X-Sendfile (Apache mod_xsendfile,
+  nginx/lighttpd with the header mapped) so certificate bytes never pass through Python
 """
 
+import io
 import os
-import time
+import re
+import errno
+import mmap
 import hmac
 import json
-import uuid
-import smtplib
-import traceback
+import hashlib
+import atexit
+import secrets
+import itertools
+import shutil
+import tempfile
+import time
+import queue
+import logging
+import logging.handlers
+import functools
+import threading
+import importlib.util
 from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from email.utils import formataddr
-from email.mime.base import MIMEBase
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email import encoders
-
-from flask import Flask, request, jsonify, send_from_directory, abort
-from flask_cors import CORS
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import cm
+from types import SimpleNamespace
+from typing import Annotated, Optional
+from email.utils import formataddr, parseaddr
+
+from flask import Flask, request, jsonify, send_from_directory
+from werkzeug.exceptions import NotFound
 from dotenv import load_dotenv
+import msgspec
+
+# orjson is optional — faster JSON encoding and decoding in jsonify() when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 load_dotenv()
 
+# --- Logging ---
+# Records (with their exc_info) are queued as-is and formatted/written to stderr by a
+# listener thread, so an error path never formats a traceback on the request thread.
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        return record
+
+class _DuplicateExceptionFilter(logging.Filter):
+    """
+    Rate-limit tracebacks: a repeat of the same exception (type + raising line) within
+    `window` seconds is still logged, but without its traceback.
+    """
+    def __init__(self, window=60.0):
+        super().__init__()
+        self.window = window
+        self._seen = {}
+
+    def filter(self, record):
+        exc_type, _, tb = record.exc_info or (None, None, None)
+        if exc_type is None:
+            return True
+        while tb is not None and tb.tb_next is not None:
+            tb = tb.tb_next
+        key = (exc_type, tb.tb_frame.f_code.co_filename, tb.tb_lineno) if tb else (exc_type,)
+        now = time.monotonic()
+        last = self._seen.get(key)
+        if last is not None and now - last < self.window:
+            record.exc_info = None
+            record.exc_text = None
+            return True
+        self._seen[key] = now
+        return True
+
+logger = logging.getLogger("ngo_backend")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_log_handler = _DeferredQueueHandler(queue.SimpleQueue())
+_log_handler.addFilter(_DuplicateExceptionFilter())
+logger.addHandler(_log_handler)
+_log_listener = None
+
+def _start_log_listener():
+    global _log_listener
+    # fresh queue + thread: also used after fork, where the parent's listener thread is gone
+    _log_handler.queue = queue.SimpleQueue()
+    stderr = logging.StreamHandler()
+    stderr.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    _log_listener = logging.handlers.QueueListener(_log_handler.queue, stderr)
+    _log_listener.start()
+
+_start_log_listener()
+if hasattr(os, "register_at_fork"):  # POSIX only; Windows has no fork
+    os.register_at_fork(after_in_child=_start_log_listener)
+atexit.register(lambda: _log_listener.stop())
+
 # Flags / keys
 USE_RAZORPAY = os.getenv("USE_RAZORPAY", "0") == "1"
 RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID", "rzp_test_dummy")
 RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET", "")
+_RAZORPAY_SECRET_BYTES = RAZORPAY_KEY_SECRET.encode()
 
 SMTP_HOST = os.getenv("SMTP_HOST", "")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 SMTP_USER = os.getenv("SMTP_USER", "")
 SMTP_PASS = os.getenv("SMTP_PASS", "")
 FROM_EMAIL = os.getenv("FROM_EMAIL", SMTP_USER or "no-reply@example.com")
+# FROM_EMAIL can be "Name <email@domain>"; parse it once rather than per email
+_FROM_DISPLAY, _FROM_ADDR = parseaddr(FROM_EMAIL)
+_FROM_HEADER = formataddr((_FROM_DISPLAY, _FROM_ADDR)) if _FROM_ADDR else FROM_EMAIL
+EMAIL_ENABLED = bool(SMTP_HOST and SMTP_USER and SMTP_PASS)
+
+EMAIL_SUBJECT = "Thank you for your donation — Pratibha Charitable Trust"
+_EMAIL_TMPL = (
+    "Dear {name},\n\n"
+    "Thank you for your generous donation of INR {amount}.\n"
+    "Please find your donation certificate attached.\n\n"
+    "Order ID: {order_id}\n"
+    "Warm regards,\nPratibha Charitable Trust"
+)
 
 FRONTEND_ORIGIN = os.getenv("FRONTEND_ORIGIN")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+USE_X_SENDFILE = os.getenv("USE_X_SENDFILE", "0") == "1"
 
-# Try to set up razorpay client if enabled
-if USE_RAZORPAY:
-    try:
-        import razorpay
-        razorpay_client = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
-    except Exception as e:
-        print("Failed to import razorpay library:", e)
-        USE_RAZORPAY = False
+# Razorpay is only imported on the first order; just check it is installed here
+if USE_RAZORPAY and importlib.util.find_spec("razorpay") is None:
+    logger.error("Failed to import razorpay library: not installed")
+    USE_RAZORPAY = False
+
+@functools.lru_cache(maxsize=1)
+def get_razorpay_client():
+    import razorpay
+    return razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
 
 # Flask app
 app = Flask(__name__)
-CORS(app, resources={r"*": {"origins": "*"}})  # dev: allow all origins; change in production
+
+if orjson is not None:
+    from flask.json.provider import JSONProvider
+
+    class OrjsonProvider(JSONProvider):
+        """jsonify() via orjson: encodes straight to bytes, datetime handled natively."""
+        _OPTS = orjson.OPT_NON_STR_KEYS
+
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, option=self._OPTS).decode()
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+        def response(self, *args, **kwargs):
+            obj = self._prepare_response_obj(args, kwargs)
+            return self._app.response_class(orjson.dumps(obj, option=self._OPTS), mimetype="application/json")
+
+    app.json = OrjsonProvider(app)
+else:
+    # JSON_SORT_KEYS replacement since Flask 2.3; key order doesn't matter to clients
+    app.json.sort_keys = False
+
+# Let the reverse proxy sendfile() the PDF; only safe when a proxy strips the header
+app.use_x_sendfile = USE_X_SENDFILE
+
+# CORS: every route shares one policy, so a single after_request hook replaces flask-cors.
+# Preflight OPTIONS requests are answered by Flask's automatic OPTIONS handling and pass through here too.
+_CORS_HEADERS = {
+    "Access-Control-Allow-Origin": FRONTEND_ORIGIN or "*",  # set FRONTEND_ORIGIN in production
+    "Access-Control-Allow-Methods": "GET,POST,OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type",
+}
+if FRONTEND_ORIGIN:
+    _CORS_HEADERS["Vary"] = "Origin"
+
+@app.after_request
+def _cors(response):
+    response.headers.update(_CORS_HEADERS)
+    return response
 
 BASE_DIR = Path(__file__).parent
-CERT_DIR = BASE_DIR / "certificates"
-CERT_DIR.mkdir(exist_ok=True)
+PERSIST_CERT_DIR = BASE_DIR / "certificates"
+CERT_DIR = Path(os.getenv("CERT_DIR") or PERSIST_CERT_DIR)
+# Opt-in RAM-backed CERT_DIR (e.g. a private dir on /dev/shm): certificates are written
+# once and read back over HTTP, so the disk isn't needed on the request path. They are
+# copied to ./certificates at shutdown, and lost on a crash or reboot before that.
+CERT_DIR_VOLATILE = os.getenv("CERT_DIR_VOLATILE", "0") == "1" and CERT_DIR != PERSIST_CERT_DIR
+CERT_DIR.mkdir(parents=True, exist_ok=True)
+PERSIST_CERT_DIR.mkdir(exist_ok=True)
+if CERT_DIR_VOLATILE and hasattr(os, "getuid"):
+    # volatile dirs usually live under a world-writable parent: refuse one another
+    # user could have created (or symlinked) first and planted certificates in
+    _st = os.lstat(CERT_DIR)
+    if CERT_DIR.is_symlink() or _st.st_uid != os.getuid() or _st.st_mode & 0o022:
+        raise RuntimeError(f"CERT_DIR {CERT_DIR} must be a directory owned by this user and not group/world-writable")
+_CERT_DIR_STR = str(CERT_DIR)
+# relative paths are resolved against this file's directory
+BULK_LIST_PATH = str(BASE_DIR / os.getenv("BULK_LIST_PATH", "bulk_certificates.json"))
+
+def persist_certificates():
+    """
+    Copy certificates from a volatile CERT_DIR to ./certificates and fsync them.
+    Call from a single process at shutdown: gunicorn.conf.py's on_exit, or the
+    __main__ block for the dev server. A no-op unless CERT_DIR_VOLATILE=1.
+    """
+    if not CERT_DIR_VOLATILE:
+        return
+    for src in CERT_DIR.glob("*.pdf"):
+        dest = PERSIST_CERT_DIR / src.name
+        if dest.exists():
+            continue
+        try:
+            with open(src, "rb") as fin, open(dest, "wb") as fout:
+                shutil.copyfileobj(fin, fout)
+                fout.flush()
+                os.fsync(fout.fileno())
+        except OSError:
+            logger.exception("Failed to persist certificate %s", src.name)
+
+# Background worker for email work, so /verify_payment doesn't wait on SMTP.
+# Certificates are rendered in the request itself (microseconds on the fast path),
+# so the URL it returns is servable by any worker immediately.
+executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="post_payment")
+
+# Per-process random tag + counter: unique ids without a clock read or urandom per call
+def _reset_id_source():
+    global _PROC_TAG, _id_seq
+    _PROC_TAG = secrets.token_hex(4)
+    _id_seq = itertools.count()
+
+_reset_id_source()
+# preloaded gunicorn workers are forked from one import; give each its own tag
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_id_source)
+
+def _unique_suffix() -> str:
+    return f"{_PROC_TAG}{next(_id_seq):x}"
+
+# Largest donation (INR) accepted; keeps amount * 100 and the certificate text sane
+MAX_AMOUNT_INR = 10_000_000
+_Amount = Annotated[int, msgspec.Meta(ge=0, le=MAX_AMOUNT_INR)]
+
+# Request schemas. Unknown fields (name/phone/program on create_order, etc.) are ignored;
+# strict=False keeps accepting "100" for amount. simulate is left untyped so lax coercion
+# can't turn 1/"true" into True; verify_signature checks `is True`.
+class CreateOrder(msgspec.Struct):
+    amount: _Amount = 0
+
+class VerifyPayload(msgspec.Struct):
+    razorpay_order_id: str
+    razorpay_payment_id: str
+    razorpay_signature: str
+    name: str = "Donor"
+    email: Optional[str] = None
+    amount: _Amount = 0
+    order_id: Optional[str] = None
+    simulate: object = None
+
+_create_order_decoder = msgspec.json.Decoder(CreateOrder, strict=False)
+_verify_decoder = msgspec.json.Decoder(VerifyPayload, strict=False)
+
+def _parse_amount():
+    """Amount from a /create_order body; raises ValueError when it isn't an integer in range."""
+    try:
+        return _create_order_decoder.decode(request.get_data(cache=True)).amount
+    except msgspec.DecodeError as e:
+        raise ValueError(str(e)) from e
+
+def _parse_verify():
+    """
+    Validated /verify_payment body (a VerifyPayload);
+    raises ValueError for missing fields or wrong types.
+    """
+    try:
+        return _verify_decoder.decode(request.get_data(cache=True))
+    except msgspec.DecodeError as e:
+        raise ValueError(str(e)) from e
 
 @app.route("/", methods=["GET"])
 def root():
     return jsonify({"status": "ok", "mode": "razorpay" if USE_RAZORPAY else "dummy"})
 
 def _fake_order(amount_inr):
-    order_id = f"order_fake_{uuid.uuid4().hex[:12]}"
+    order_id = f"order_fake_{secrets.token_hex(6)}"
     return {"id": order_id, "amount": amount_inr * 100, "currency": "INR", "key": RAZORPAY_KEY_ID, "mode": "dummy"}
 
 @app.route("/create_order", methods=["POST"])
 def create_order():
-    data = request.get_json() or {}
     # We accept name/email/phone but they are not required to create the order in dummy mode
     try:
-        amount = int(data.get("amount", 0))
-    except Exception:
+        amount = _parse_amount()
+    except (TypeError, ValueError):
         return jsonify({"error": "Invalid amount"}), 400
     if amount <= 0:
         return jsonify({"error": "Amount must be > 0"}), 400
@@ -91,10 +322,10 @@ def create_order():
             order_data = {
                 "amount": amount * 100,
                 "currency": "INR",
-                "receipt": f"rcpt_{int(time.time())}",
+                "receipt": f"rcpt_{_unique_suffix()}",
                 "payment_capture": 1,
             }
-            order = razorpay_client.order.create(order_data)
+            order = get_razorpay_client().order.create(order_data)
             return jsonify({
                 "id": order["id"],
                 "amount": order["amount"],
@@ -103,40 +334,40 @@ def create_order():
                 "mode": "razorpay"
             })
         except Exception as e:
-            traceback.print_exc()
+            logger.exception("Razorpay order creation failed")
             return jsonify({"error": "Razorpay order creation failed", "details": str(e)}), 500
     else:
         # Dummy order
         return jsonify(_fake_order(amount))
 
-def verify_signature(payload_dict):
+def verify_signature(payload):
     """
-    For Razorpay mode, verify signature with Razorpay SDK.
+    For Razorpay mode, verify signature as HMAC-SHA256(key_secret, "order_id|payment_id"),
+    the same check the Razorpay SDK performs.
     For Dummy mode, we accept if:
       - payload contains simulate: true, OR
       - razorpay_signature equals "sim_signature".
     We still require razorpay_order_id, razorpay_payment_id, razorpay_signature fields to exist.
     """
     try:
-        razorpay_order_id = payload_dict.get("razorpay_order_id")
-        razorpay_payment_id = payload_dict.get("razorpay_payment_id")
-        razorpay_signature = payload_dict.get("razorpay_signature")
+        razorpay_order_id = payload.razorpay_order_id
+        razorpay_payment_id = payload.razorpay_payment_id
+        razorpay_signature = payload.razorpay_signature
         if not (razorpay_order_id and razorpay_payment_id and razorpay_signature):
             return False, "Missing fields"
 
         if USE_RAZORPAY:
-            try:
-                razorpay_client.utility.verify_payment_signature({
-                    "razorpay_order_id": razorpay_order_id,
-                    "razorpay_payment_id": razorpay_payment_id,
-                    "razorpay_signature": razorpay_signature
-                })
+            expected = hmac.new(
+                _RAZORPAY_SECRET_BYTES,
+                f"{razorpay_order_id}|{razorpay_payment_id}".encode(),
+                hashlib.sha256
+            ).hexdigest()
+            if hmac.compare_digest(expected, str(razorpay_signature)):
                 return True, None
-            except Exception as e:
-                return False, str(e)
+            return False, "Razorpay Signature Verification Failed"
         else:
             # Dummy mode
-            if payload_dict.get("simulate") is True:
+            if payload.simulate is True:
                 return True, None
             if razorpay_signature == "sim_signature":
                 return True, None
@@ -146,142 +377,598 @@ def verify_signature(payload_dict):
 
 @app.route("/verify_payment", methods=["POST"])
 def verify_payment():
-    payload = request.get_json() or {}
+    try:
+        payload = _parse_verify()
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": "Invalid request body", "details": str(e)}), 400
     ok, err = verify_signature(payload)
     if not ok:
         return jsonify({"error": "Signature verification failed", "details": err}), 400
 
-    # If verified, generate certificate and email it.
+    # If verified, generate the certificate and queue the email.
     try:
-        donor_name = payload.get("name", "Donor")
-        donor_email = payload.get("email")
-        amount = int(payload.get("amount", 0))
-        order_id = payload.get("razorpay_order_id", payload.get("order_id", f"order_{int(time.time())}"))
+        donor_name = payload.name
+        donor_email = payload.email
+        amount = payload.amount
+        order_id = payload.razorpay_order_id or payload.order_id or f"order_{_unique_suffix()}"
 
-        # Generate PDF certificate
-        fname = generate_certificate(donor_name, amount, order_id)
+        # Filename is derived from the donation itself, so a retry maps to the same file
+        fname = certificate_filename(donor_name, amount, order_id)
         cert_url = f"/certificate/{fname}"
 
-        # Email with attachment
-        email_sent = False
-        email_err = None
-        if donor_email and SMTP_HOST and SMTP_USER and SMTP_PASS:
+        email_queued = False
+        if not _find_certificate(fname):
+            send_email = bool(donor_email and EMAIL_ENABLED)
+            pdf_future = Future()
+            if send_email:
+                # queued first so the SMTP handshake overlaps with the rendering below
+                executor.submit(_email_certificate_job, donor_name, donor_email, amount, order_id, fname, pdf_future)
             try:
-                subject = "Thank you for your donation — Pratibha Charitable Trust"
-                body = (
-                    f"Dear {donor_name},\n\n"
-                    f"Thank you for your generous donation of INR {amount}.\n"
-                    f"Please find your donation certificate attached.\n\n"
-                    f"Order ID: {order_id}\n"
-                    f"Warm regards,\nPratibha Charitable Trust"
-                )
-                send_email_with_attachment(
-                    to_email=donor_email,
-                    subject=subject,
-                    body=body,
-                    attachment_path=str(CERT_DIR / fname)
-                )
-                email_sent = True
-            except Exception as e:
-                traceback.print_exc()
-                email_err = str(e)
+                _, pdf_bytes = generate_certificate(donor_name, amount, order_id, fname)
+                created = _publish_certificate(fname, pdf_bytes)
+            except BaseException as e:
+                pdf_future.set_exception(e)
+                raise
+            # a concurrent retry (any worker) published it first and owns the email
+            pdf_future.set_result(pdf_bytes if created else None)
+            email_queued = send_email and created
 
         result = {
             "status": "success",
             "message": "Payment verified" if USE_RAZORPAY else "Dummy payment accepted",
             "payment": {"order_id": order_id, "amount": amount},
             "certificate_url": cert_url,
-            "email_sent": email_sent,
-            "email_error": email_err
+            "email_queued": email_queued
         }
         return jsonify(result)
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("Failed to generate certificate")
         return jsonify({"error": "Internal error generating certificate", "details": str(e)}), 500
 
+def _email_certificate_job(donor_name, donor_email, amount, order_id, fname, pdf_future):
+    """
+    Runs on the background executor: email the certificate the request renders
+    into pdf_future. The SMTP session is opened (or health-checked) first, so
+    the handshake runs while the request thread is still rendering.
+    Errors are logged here since nobody is waiting on the response.
+    """
+    try:
+        smtp_pool.get()
+    except Exception:
+        logger.exception("SMTP connection failed for %s", order_id)
+        return
+    try:
+        pdf_bytes = pdf_future.result()
+    except Exception:
+        return  # already reported by verify_payment
+    if pdf_bytes is None:
+        return  # duplicate of a request that already sent this email
+
+    try:
+        send_email_with_attachment(
+            to_email=donor_email,
+            subject=EMAIL_SUBJECT,
+            body=_EMAIL_TMPL.format(name=donor_name, amount=amount, order_id=order_id),
+            attachment_bytes=pdf_bytes,
+            attachment_name=fname
+        )
+    except Exception:
+        logger.exception("Certificate email failed for %s", order_id)
+
 @app.route("/certificate/<path:filename>", methods=["GET"])
 def serve_certificate(filename):
-    full = CERT_DIR / filename
-    if not full.exists():
-        return abort(404)
-    return send_from_directory(str(CERT_DIR), filename, as_attachment=True)
+    # send_from_directory raises NotFound itself, so no separate exists() check;
+    # it hands the open file to wsgi.file_wrapper with Content-Length set,
+    # which gunicorn/uWSGI serve with sendfile(); with USE_X_SENDFILE the proxy does it instead.
+    try:
+        return send_from_directory(_CERT_DIR_STR, filename, as_attachment=True)
+    except NotFound:
+        if CERT_DIR == PERSIST_CERT_DIR:
+            raise
+        # certificates from before the last restart only exist in ./certificates
+        return send_from_directory(str(PERSIST_CERT_DIR), filename, as_attachment=True)
 
 # --- PDF generator ---
-def generate_certificate(name, amount, order_id) -> str:
+def certificate_filename(name, amount, order_id) -> str:
     """
-    Creates a clean A4 certificate PDF and returns the filename.
+    Content-addressed name: the same donation always maps to the same file,
+    so retries reuse it instead of rendering a new one.
     """
-    now = datetime.utcnow().strftime("%Y-%m-%d")
-    safe_order = order_id.replace("/", "_")
-    filename = f"certificate_{safe_order}_{int(time.time())}.pdf"
-    path = CERT_DIR / filename
-
-    c = canvas.Canvas(str(path), pagesize=A4)
-    w, h = A4
+    key = hashlib.blake2b(f"{name}|{amount}|{order_id}".encode(), digest_size=8).hexdigest()
+    return f"certificate_{key}.pdf"
+
+# Read once: os.umask() can only be queried by setting it, which isn't thread-safe later
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+_CERT_FILE_MODE = 0o666 & ~_UMASK  # what open() would give, e.g. 0644 for the proxy to read
+# os.link errors meaning "this filesystem has no hard links", not "name taken"
+_NO_LINK_ERRNOS = {errno.EPERM, errno.EXDEV, errno.EMLINK,
+                   getattr(errno, "ENOTSUP", errno.EPERM), getattr(errno, "EOPNOTSUPP", errno.EPERM)}
+
+def _publish_certificate(filename, pdf_bytes) -> bool:
+    """
+    Write the PDF under CERT_DIR, atomically: it is written to a temp file and
+    hard-linked into place, which fails if the name already exists. Returns
+    False when another request (in this or another worker) got there first.
+    """
+    path = os.path.join(_CERT_DIR_STR, filename)
+    fd, tmp = tempfile.mkstemp(prefix=".cert_", suffix=".tmp", dir=_CERT_DIR_STR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(pdf_bytes)
+            if hasattr(os, "fchmod"):
+                os.fchmod(f.fileno(), _CERT_FILE_MODE)  # mkstemp creates 0600
+        try:
+            os.link(tmp, path)
+        except FileExistsError:
+            return False
+        except OSError as e:
+            if e.errno not in _NO_LINK_ERRNOS:
+                raise
+            return _create_exclusive(path, pdf_bytes)
+        return True
+    finally:
+        os.unlink(tmp)
+
+def _create_exclusive(path, pdf_bytes) -> bool:
+    """Fallback without hard links: O_EXCL still picks one winner, but readers may see a partial file."""
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "wb") as f:
+        f.write(pdf_bytes)
+    return True
+
+def _find_certificate(filename):
+    for d in (CERT_DIR, PERSIST_CERT_DIR):
+        p = d / filename
+        if p.exists():
+            return str(p)
+    return None
+
+# ReportLab (and pypdf) are imported on the first certificate rather than at startup,
+# so workers that never render a PDF don't pay for them. gunicorn.conf.py calls
+# warm_pdf() in the master so preloaded workers share the result.
+FONT_HEADING = "Helvetica-Bold"
+FONT_BODY = "Helvetica"
+FONT_SIGN = "Helvetica-Oblique"
+
+@functools.lru_cache(maxsize=1)
+def _pdf():
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.units import cm
+    from reportlab.pdfbase import pdfmetrics
+    # pypdf is optional — with it, certificates are a cached template + per-donor overlay
+    try:
+        from pypdf import PdfReader, PdfWriter
+    except ImportError:
+        PdfReader = PdfWriter = None
+
+    # Resolve the fonts once so ReportLab builds its font objects here, not per certificate
+    for font in (FONT_HEADING, FONT_BODY, FONT_SIGN):
+        pdfmetrics.getFont(font)
+    return SimpleNamespace(
+        A4=A4, cm=cm, canvas=canvas, PdfReader=PdfReader, PdfWriter=PdfWriter,
+        color_border=colors.HexColor("#6C63FF"),
+        color_text=colors.HexColor("#333333"),
+    )
 
+def _draw_static(c, w, h):
+    """Border, headings and signature line: identical on every certificate."""
+    pdf = _pdf()
+    cm = pdf.cm
     # border
-    c.setStrokeColor(colors.HexColor("#6C63FF"))
+    c.setStrokeColor(pdf.color_border)
     c.setLineWidth(6)
     c.rect(1.0*cm, 1.0*cm, w-2.0*cm, h-2.0*cm)
 
     # heading
-    c.setFont("Helvetica-Bold", 28)
+    c.setFont(FONT_HEADING, 28)
     c.drawCentredString(w/2, h-3.5*cm, "Certificate of Appreciation")
 
     # NGO name
-    c.setFont("Helvetica-Bold", 16)
-    c.setFillColor(colors.HexColor("#333333"))
+    c.setFont(FONT_HEADING, 16)
+    c.setFillColor(pdf.color_text)
     c.drawCentredString(w/2, h-5.0*cm, "Pratibha Charitable Trust")
 
-    # text
-    c.setFont("Helvetica", 12.5)
-    text = (
-        f"This certificate is proudly presented to\n\n"
-        f"{name}\n\n"
-        f"for supporting our mission through a donation of INR {amount}.\n"
-        f"Order ID: {order_id}    Date: {now}"
+    # sign
+    c.setFont(FONT_SIGN, 11)
+    c.drawString(2.5*cm, 3.0*cm, "Signature")
+    c.line(2.5*cm, 2.9*cm, 7.5*cm, 2.9*cm)
+
+def _field_lines(name, amount, order_id, now):
+    """The three donor-specific lines of the text block."""
+    return (
+        f"{name}",
+        f"for supporting our mission through a donation of INR {amount}.",
+        f"Order ID: {order_id}    Date: {now}",
     )
+
+def _draw_fields(c, w, h, name_line, amount_line, order_line):
+    """The donor-specific text block."""
+    pdf = _pdf()
+    cm = pdf.cm
+    c.setFillColor(pdf.color_text)
+    lines = ("This certificate is proudly presented to", "", name_line, "", amount_line, order_line)
+    # one font operator inside the text object instead of a canvas-level setFont
     textobj = c.beginText(w/2 - 7.5*cm, h-8.0*cm)
-    for line in text.split("\n"):
+    textobj.setFont(FONT_BODY, 12.5)
+    for line in lines:
         textobj.textLine(line)
     c.drawText(textobj)
 
-    # sign
-    c.setFont("Helvetica-Oblique", 11)
-    c.drawString(2.5*cm, 3.0*cm, "Signature")
-    c.line(2.5*cm, 2.9*cm, 7.5*cm, 2.9*cm)
+@functools.lru_cache(maxsize=1)
+def _template_pdf():
+    """
+    Render the static layout once; donor fields are overlaid per request.
+    None when pypdf is not available to merge the overlay.
+    """
+    pdf = _pdf()
+    if pdf.PdfReader is None:
+        return None
+    buf = io.BytesIO()
+    c = pdf.canvas.Canvas(buf, pagesize=pdf.A4)
+    _draw_static(c, *pdf.A4)
+    c.showPage()
+    c.save()
+    return buf.getvalue()
+
+# Fast path: the layout is fixed and only three text lines vary, so the whole
+# certificate is rendered once, uncompressed, with fixed-width placeholder lines
+# and each request just patches those bytes. Each value is closed right away and
+# padded with spaces after the ")" (ignored in a content stream), so the text
+# itself has no trailing blanks and stream /Length and xref offsets never move.
+# The /CreationDate, /ModDate and trailer /ID are fixed-width and patched too.
+_FIELD_WIDTH = 96
+_SENTINELS = tuple(f"@@{key}@@".ljust(_FIELD_WIDTH, "#") for key in ("NAME", "AMOUNT", "ORDER"))
+_SLOT_WIDTH = _FIELD_WIDTH + 1  # placeholder text plus its closing paren
+_PDF_DATE_RE = re.compile(rb"/(?:CreationDate|ModDate) \((D:[^)]*)\)")
+_PDF_ID_RE = re.compile(rb"/ID\s*\[<([0-9a-f]{32})><([0-9a-f]{32})>\]")
+
+# PDF literal-string escaping for one WinAnsi byte, as ReportLab emits it
+_PDF_ESCAPES = tuple(
+    b"\\" + bytes([i]) if i in b"\\()" else bytes([i]) if 32 <= i < 127 else b"\\%03o" % i
+    for i in range(256)
+)
+
+def _pdf_escape(line):
+    """Escaped WinAnsi bytes for line, or None when it has characters Helvetica can't encode."""
+    try:
+        raw = line.encode("cp1252")
+    except UnicodeEncodeError:
+        return None
+    return b"".join([_PDF_ESCAPES[i] for i in raw])
 
+@functools.lru_cache(maxsize=1)
+def _specialized_template():
+    """
+    (template bytes, placeholder offsets, date offsets, /ID offsets),
+    or None if any of them can't be located.
+    """
+    pdf = _pdf()
+    buf = io.BytesIO()
+    c = pdf.canvas.Canvas(buf, pagesize=pdf.A4, pageCompression=0)
+    w, h = pdf.A4
+    _draw_static(c, w, h)
+    _draw_fields(c, w, h, *_SENTINELS)
+    c.showPage()
+    c.save()
+    data = buf.getvalue()
+
+    offsets = []
+    for sentinel in _SENTINELS:
+        marker = b"(" + sentinel.encode("ascii") + b")"
+        if data.count(marker) != 1:
+            return None
+        offsets.append(data.index(marker) + 1)
+
+    dates = [m.start(1) for m in _PDF_DATE_RE.finditer(data)]
+    if len(dates) != 2 or len(_pdf_timestamp()) != len(_PDF_DATE_RE.search(data).group(1)):
+        return None
+    ids = _PDF_ID_RE.search(data)
+    if ids is None:
+        return None
+    return data, tuple(offsets), tuple(dates), (ids.start(1), ids.start(2))
+
+def _pdf_timestamp():
+    return datetime.utcnow().strftime("D:%Y%m%d%H%M%S+00'00'").encode("ascii")
+
+def _render_specialized(lines):
+    """Patch the donor lines into the pre-rendered certificate; None if they don't fit."""
+    spec = _specialized_template()
+    if spec is None:
+        return None
+    data, offsets, dates, ids = spec
+    out = bytearray(data)
+    encoded_lines = []
+    for offset, line in zip(offsets, lines):
+        encoded = _pdf_escape(line)
+        if encoded is None or len(encoded) > _FIELD_WIDTH:
+            return None
+        encoded_lines.append(encoded)
+        out[offset:offset + _SLOT_WIDTH] = (encoded + b")").ljust(_SLOT_WIDTH, b" ")
+
+    stamp = _pdf_timestamp()
+    for offset in dates:
+        out[offset:offset + len(stamp)] = stamp
+    # same content -> same /ID, matching the content-addressed filename
+    doc_id = hashlib.blake2b(b"\n".join(encoded_lines), digest_size=16).hexdigest().encode("ascii")
+    for offset in ids:
+        out[offset:offset + 32] = doc_id
+    return bytes(out)
+
+def warm_pdf():
+    """Import the PDF libraries and build the certificate templates now."""
+    _template_pdf()
+    _specialized_template()
+
+def generate_certificate(name, amount, order_id, filename=None):
+    """
+    Renders a clean A4 certificate PDF in memory and returns (filename, pdf_bytes).
+    Writing it to CERT_DIR is left to the caller.
+    """
+    now = datetime.utcnow().strftime("%Y-%m-%d")
+    if filename is None:
+        filename = certificate_filename(name, amount, order_id)
+    lines = _field_lines(name, amount, order_id, now)
+    specialized = _render_specialized(lines)
+    if specialized is not None:
+        return filename, specialized
+
+    # Non-WinAnsi or over-long fields: draw them with ReportLab
+    pdf = _pdf()
+    template = _template_pdf()
+    w, h = pdf.A4
+
+    if template is None:
+        buf = io.BytesIO()
+        c = pdf.canvas.Canvas(buf, pagesize=pdf.A4)
+        _draw_static(c, w, h)
+        _draw_fields(c, w, h, *lines)
+        c.showPage()
+        c.save()
+        return filename, buf.getvalue()
+
+    overlay_buf = io.BytesIO()
+    c = pdf.canvas.Canvas(overlay_buf, pagesize=pdf.A4)
+    _draw_fields(c, w, h, *lines)
     c.showPage()
     c.save()
-    return filename
+    overlay_buf.seek(0)
+
+    page = pdf.PdfReader(io.BytesIO(template)).pages[0]
+    page.merge_page(pdf.PdfReader(overlay_buf).pages[0])
+    writer = pdf.PdfWriter()
+    writer.add_page(page)
+    out = io.BytesIO()
+    writer.write(out)
+    return filename, out.getvalue()
 
 # --- Email helper ---
-def send_email_with_attachment(to_email, subject, body, attachment_path):
-    msg = MIMEMultipart()
-    # FROM_EMAIL can be "Name <email@domain>"
-    if "<" in FROM_EMAIL and ">" in FROM_EMAIL:
-        display_name = FROM_EMAIL.split("<")[0].strip()
-        sender_email = FROM_EMAIL.split("<")[1].split(">")[0].strip()
-        msg["From"] = formataddr((display_name, sender_email))
+def _make_local():
+    """Greenlet-local storage under gevent monkey-patching, thread-local otherwise."""
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched("threading"):
+            from gevent.local import local
+            return local()
+    except ImportError:
+        pass
+    return threading.local()
+
+class _SmtpPool:
+    """
+    One logged-in SMTP session per thread, reused across messages.
+    Reconnects (STARTTLS + login) only when the cached session fails a NOOP.
+    """
+    def __init__(self, host, port, user, password):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self._local = _make_local()
+        self._lock = threading.Lock()
+        self._servers = []
+
+    def _connect(self):
+        import smtplib
+        server = smtplib.SMTP(self.host, self.port)
+        try:
+            server.starttls()
+            server.login(self.user, self.password)
+        except BaseException:
+            # e.g. bad credentials: don't leak the connected socket
+            server.close()
+            raise
+        with self._lock:
+            self._servers.append(server)
+        return server
+
+    def _discard(self, server):
+        with self._lock:
+            if server in self._servers:
+                self._servers.remove(server)
+        try:
+            server.close()
+        except Exception:
+            pass
+
+    def get(self, check=True):
+        """
+        This thread's session. check=False skips the NOOP round trip for callers
+        that health-check on their own schedule (bulk sends).
+        """
+        import smtplib
+        server = getattr(self._local, "server", None)
+        if server is not None:
+            if not check:
+                return server
+            try:
+                server.noop()
+                return server
+            except (smtplib.SMTPServerDisconnected, OSError):
+                self._discard(server)
+        server = self._connect()
+        self._local.server = server
+        return server
+
+    def invalidate(self):
+        server = getattr(self._local, "server", None)
+        self._local.server = None
+        if server is not None:
+            self._discard(server)
+
+    def close(self):
+        with self._lock:
+            servers, self._servers = self._servers, []
+        for server in servers:
+            try:
+                server.quit()
+            except Exception:
+                pass
+
+smtp_pool = _SmtpPool(SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS)
+atexit.register(smtp_pool.close)
+
+def _build_message(to_header, subject, body, attachment_path=None,
+                   attachment_bytes=None, attachment_name=None):
+    from email.message import EmailMessage
+    msg = EmailMessage()
+    msg["From"] = _FROM_HEADER
+    msg["To"] = to_header
+    msg["Subject"] = subject
+    msg.set_content(body)
+
+    if attachment_bytes is not None:
+        msg.add_attachment(attachment_bytes, maintype="application", subtype="pdf",
+                           filename=attachment_name)
     else:
-        msg["From"] = FROM_EMAIL
+        _attach_file(msg, attachment_path, attachment_name or os.path.basename(attachment_path))
+    return msg
 
-    msg["To"] = to_email
-    msg["Subject"] = subject
-    msg.attach(MIMEText(body, "plain"))
+# Below this, one fstat + one read() beats setting up a mapping
+_MMAP_THRESHOLD = 1 << 20
+
+def _attach_file(msg, path, filename):
+    # O_BINARY: on Windows os.open defaults to text mode (CRLF translation, stops at 0x1A)
+    fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        size = os.fstat(fd).st_size
+        if size < _MMAP_THRESHOLD:
+            # unbuffered: a single syscall into a single allocation
+            data = os.read(fd, size)
+            while len(data) < size:
+                chunk = os.read(fd, size - len(data))
+                if not chunk:
+                    break
+                data += chunk
+            msg.add_attachment(data, maintype="application", subtype="pdf", filename=filename)
+        else:
+            # large files are paged in while being base64-encoded instead of copied first
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as data:
+                msg.add_attachment(data, maintype="application", subtype="pdf", filename=filename)
+    finally:
+        os.close(fd)
+
+def _send(msg, to_addrs=None, check=True):
+    import smtplib
+    server = smtp_pool.get(check=check)
+    try:
+        server.send_message(msg, from_addr=_FROM_ADDR or None, to_addrs=to_addrs)
+    except smtplib.SMTPServerDisconnected:
+        # Session dropped since the last NOOP; retry once on a fresh one
+        smtp_pool.invalidate()
+        smtp_pool.get().send_message(msg, from_addr=_FROM_ADDR or None, to_addrs=to_addrs)
+
+def send_email_with_attachment(to_email, subject, body, attachment_path=None,
+                               attachment_bytes=None, attachment_name=None):
+    """
+    Send a PDF attachment either from memory (attachment_bytes) or from disk
+    (attachment_path, mmap-ed). attachment_name defaults to the path's basename.
+    to_email may be a list: one message then goes to all of them as BCC in a
+    single transaction.
+    """
+    if isinstance(to_email, (list, tuple)):
+        msg = _build_message(_FROM_HEADER, subject, body, attachment_path,
+                             attachment_bytes, attachment_name)
+        _send(msg, to_addrs=list(to_email))
+    else:
+        msg = _build_message(to_email, subject, body, attachment_path,
+                             attachment_bytes, attachment_name)
+        _send(msg)
 
-    with open(attachment_path, "rb") as f:
-        part = MIMEBase('application', "octet-stream")
-        part.set_payload(f.read())
-    encoders.encode_base64(part)
-    part.add_header('Content-Disposition', f'attachment; filename="{Path(attachment_path).name}"')
-    msg.attach(part)
+# --- Bulk certificates ---
+BULK_NOOP_EVERY = 50
 
-    with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-        server.starttls()
-        server.login(SMTP_USER, SMTP_PASS)
-        server.send_message(msg)
+def send_bulk_certificates(donors):
+    """
+    Email personalised certificates to a list of donors
+    ({"name", "email", "amount", "order_id"}) over one SMTP session,
+    sending a NOOP every BULK_NOOP_EVERY messages instead of before each one.
+    Returns (sent, failed).
+    """
+    sent = failed = 0
+    for i, donor in enumerate(donors):
+        if i and i % BULK_NOOP_EVERY == 0:
+            try:
+                smtp_pool.get()  # NOOP health check; reconnects if the server dropped us
+            except Exception:
+                logger.exception("SMTP health check failed during bulk send")
+        order_ref = donor.get("order_id") if isinstance(donor, dict) else repr(donor)
+        try:
+            name = donor.get("name", "Donor")
+            amount = int(donor.get("amount", 0))
+            order_id = str(donor["order_id"])
+            fname = certificate_filename(name, amount, order_id)
+            path = _find_certificate(fname)
+            pdf_bytes = None
+            if path is None:
+                fname, pdf_bytes = generate_certificate(name, amount, order_id, fname)
+                # same content-addressed name as /verify_payment; if it won the race we
+                # still email our own (identical) bytes
+                _publish_certificate(fname, pdf_bytes)
+            msg = _build_message(donor["email"], EMAIL_SUBJECT,
+                                 _EMAIL_TMPL.format(name=name, amount=amount, order_id=order_id),
+                                 attachment_path=path, attachment_bytes=pdf_bytes,
+                                 attachment_name=fname)
+            _send(msg, check=False)
+            sent += 1
+        except Exception:
+            logger.exception("Bulk certificate failed for %s", order_ref)
+            failed += 1
+    return sent, failed
+
+def _bulk_job(list_path):
+    try:
+        with open(list_path, "rb") as f:
+            donors = json.load(f)
+        sent, failed = send_bulk_certificates(donors)
+        logger.info("Bulk certificates from %s: %d sent, %d failed", list_path, sent, failed)
+    except Exception:
+        logger.exception("Bulk certificate job failed for %s", list_path)
+
+@app.route("/send_bulk_certificates", methods=["POST"])
+def send_bulk_certificates_route():
+    # Admin-only: disabled unless ADMIN_TOKEN is configured
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Not found"}), 404
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+    if not hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode()):
+        return jsonify({"error": "Unauthorized"}), 401
+    if not EMAIL_ENABLED:
+        return jsonify({"error": "SMTP is not configured"}), 400
+    if not os.path.exists(BULK_LIST_PATH):
+        return jsonify({"error": "Bulk list not found", "details": os.path.basename(BULK_LIST_PATH)}), 400
+
+    executor.submit(_bulk_job, BULK_LIST_PATH)
+    return jsonify({"status": "queued", "list": os.path.basename(BULK_LIST_PATH)})
 
 if __name__ == "__main__":
-    # Don’t expose in prod; use gunicorn/uvicorn and proper CORS
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # With the reloader, only the outer watcher process persists (once, after the server child exits)
+    if os.environ.get("WERKZEUG_RUN_MAIN") != "true":
+        atexit.register(persist_certificates)
+    # Don’t expose in prod; use gunicorn (see gunicorn.conf.py) and set FRONTEND_ORIGIN
+    app.run(host="0.0.0.0", port=5000, debug=os.getenv("FLASK_DEBUG") == "1")
@@ -0,0 +1,35 @@
+# gunicorn.conf.py
+"""
+Production server config:  gunicorn backend_prod_ready:app
+
+gevent workers let SMTP and disk IO run cooperatively instead of one request
+at a time. Patch the stdlib before the app is imported (preload_app imports it
+in the master), so smtplib/ssl/threading are gevent-aware in every worker.
+"""
+
+from gevent import monkey
+monkey.patch_all()
+
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gevent"
+worker_connections = 1000
+# Import the app (razorpay client, certificate template) once in the master
+# and fork it copy-on-write into the workers
+preload_app = True
+
+
+def when_ready(server):
+    # Runs in the master after the preloaded app import: build the PDF template
+    # here too so every forked worker inherits it instead of rendering its own.
+    import backend_prod_ready
+    backend_prod_ready.warm_pdf()
+
+
+def on_exit(server):
+    # Master only, after the workers have stopped: copy a volatile CERT_DIR to disk once
+    import backend_prod_ready
+    backend_prod_ready.persist_certificates()